@@ -0,0 +1 @@
+"""Benchmarks for GitPy. Run a benchmark from the repository root with `python -m benchmarks.<name>`."""
@@ -0,0 +1,82 @@
+"""Startup benchmark: measures how long a `gitpy` invocation spends before doing any work.
+
+Runs `python -X importtime gitpy <command>` a number of times inside a freshly initialized
+repository and reports the median wall time and import time. Exits with status 1 if the
+median wall time is over the budget, so it can be used to catch startup regressions.
+
+    python -m benchmarks.startup [--runs N] [--budget MS] [command ...]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GITPY = os.path.join(ROOT, "gitpy")
+
+# Median wall time, in milliseconds, a `gitpy log` on an empty repository may take
+DEFAULT_BUDGET_MS = 75.0
+
+
+def parse_importtime(stderr):
+    """Returns {module: cumulative microseconds} for the top-level imports in -X importtime output"""
+    ret = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Nested imports are indented, only keep the top-level ones
+        if not name.startswith("  "):
+            ret[name.strip()] = int(cumulative)
+    return ret
+
+
+def run_once(argv, cwd):
+    """Runs gitpy once, returns (wall time in ms, {module: import time in ms})"""
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-X", "importtime", GITPY] + argv,
+                          cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    wall = (time.perf_counter() - start) * 1000
+    imports = {k: v / 1000 for k, v in parse_importtime(proc.stderr).items()}
+    return wall, imports
+
+
+def main(argv=sys.argv[1:]):
+    parser = argparse.ArgumentParser(description="GitPy startup benchmark")
+    parser.add_argument("--runs", type=int, default=20, help="Number of invocations to time.")
+    parser.add_argument("--budget", type=float, default=DEFAULT_BUDGET_MS,
+                        help="Maximum median wall time in milliseconds.")
+    parser.add_argument("command", nargs="*", default=["log"], help="gitpy command to run.")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as repo:
+        subprocess.run([sys.executable, GITPY, "init", repo], check=True)
+
+        walls = []
+        imports = {}
+        for _ in range(args.runs):
+            wall, imp = run_once(args.command, repo)
+            walls.append(wall)
+            for name, t in imp.items():
+                imports.setdefault(name, []).append(t)
+
+    median = statistics.median(walls)
+    print("gitpy %s: median %.1f ms over %d runs (budget %.1f ms)"
+          % (" ".join(args.command), median, args.runs, args.budget))
+
+    print("Slowest top-level imports (median ms):")
+    slowest = sorted(imports.items(), key=lambda x: statistics.median(x[1]), reverse=True)
+    for name, times in slowest[:10]:
+        print("  %8.2f  %s" % (statistics.median(times), name))
+
+    if median > args.budget:
+        print("Startup budget exceeded!")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,208 @@
+"""Benchmark suite for the GitPy hot paths.
+
+Generates a synthetic repository (see benchmarks.synthetic), then times
+ - in isolation: object_write, object_read, update_index, tree_from_index, tree_checkout
+   and log_graphviz, called in-process;
+ - end to end: the add, commit, checkout, log and cat-file commands, run as subprocesses.
+
+Results are written as JSON so runs on different revisions can be compared:
+
+    python -m benchmarks.suite --output before.json
+    python -m benchmarks.suite --output after.json --compare before.json
+"""
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks import synthetic
+from benchmarks.startup import GITPY, ROOT
+
+
+def timeit(fn, repeat, setup=None):
+    """Calls fn repeat times, running setup (untimed) before each call. Returns timing stats in seconds."""
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+
+    return {
+        "min": min(times),
+        "median": statistics.median(times),
+        "mean": statistics.mean(times),
+        "repeat": repeat,
+    }
+
+
+def isolated(path, info, repeat):
+    """Times the library functions directly"""
+    import gitpy
+    from objects import GitPyBlob, object_iter, object_read, object_write, tree_checkout
+    from gitpyargs import log_graphviz
+    from util import repo_find
+
+    repo = repo_find(path)
+    paths = info["paths"]
+    shas = list(object_iter(repo))
+    head = gitpy.ref_resolve(repo, "HEAD")
+    tree = object_read(repo, object_read(repo, head).kvlm[b'tree'].decode("ascii"))
+    contents = []
+    for p in paths:
+        with open(os.path.join(path, p), "rb") as f:
+            contents.append(f.read())
+
+    blobs = []
+    generation = [0]
+
+    def new_blobs():
+        # object_write skips existing objects, so every run needs content not in the store yet
+        generation[0] += 1
+        blobs[:] = [GitPyBlob(repo, data + b"\nbench %d" % generation[0]) for data in contents]
+
+    def write_objects():
+        for blob in blobs:
+            object_write(blob)
+
+    def read_objects():
+        for sha in shas:
+            object_read(repo, sha)
+
+    def checkout():
+        with tempfile.TemporaryDirectory() as dest:
+            tree_checkout(repo, tree, dest.encode())
+
+    def log():
+        with contextlib.redirect_stdout(io.StringIO()):
+            log_graphviz(repo, head, set())
+
+    ret = {}
+    with synthetic.chdir(path):
+        ret["object_write"] = timeit(write_objects, repeat, setup=new_blobs)
+        ret["object_read"] = timeit(read_objects, repeat)
+        ret["update_index"] = timeit(lambda: gitpy.update_index(*paths, repo=repo), repeat)
+        ret["tree_from_index"] = timeit(lambda: gitpy.tree_from_index(repo), repeat)
+        ret["tree_checkout"] = timeit(checkout, repeat)
+        ret["log_graphviz"] = timeit(log, repeat)
+
+        # Leave the INDEX as commit left it
+        open(gitpy.repo_file(repo, "INDEX"), "w").close()
+
+    return ret
+
+
+def end_to_end(path, info, repeat):
+    """Times the gitpy commands, including interpreter startup"""
+    paths = info["paths"]
+    counter = [0]
+
+    def run(*argv):
+        subprocess.run([sys.executable, GITPY] + list(argv), cwd=path, check=True,
+                       stdout=subprocess.DEVNULL)
+
+    def touch():
+        # Modify one file so that every commit has something to record
+        counter[0] += 1
+        with open(os.path.join(path, paths[counter[0] % len(paths)]), "ab") as f:
+            f.write(b"bench %d\n" % counter[0])
+        run("add", "-a")
+
+    with open(os.path.join(path, paths[0]), "rb") as f:
+        data = f.read()
+        blob = hashlib.sha1(b"blob " + str(len(data)).encode() + b"\x00" + data).hexdigest()
+
+    checkouts = tempfile.mkdtemp()
+
+    def checkout():
+        counter[0] += 1
+        run("checkout", "HEAD", os.path.join(checkouts, str(counter[0])))
+
+    ret = {
+        "add": timeit(lambda: run("add", "-a"), repeat),
+        "commit": timeit(lambda: run("commit", "bench", "bench", "message"), repeat, setup=touch),
+        "checkout": timeit(checkout, repeat),
+        "log": timeit(lambda: run("log"), repeat),
+        "cat-file": timeit(lambda: run("cat-file", "blob", blob, "."), repeat),
+    }
+
+    shutil.rmtree(checkouts)
+    return ret
+
+
+def revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(new, old):
+    """Prints the ratio of the new median timings to the old ones"""
+    print("%-28s %12s %12s %8s" % ("benchmark", "old (ms)", "new (ms)", "ratio"))
+    for group in ("isolated", "end_to_end"):
+        for name, stats in new["results"].get(group, {}).items():
+            prev = old["results"].get(group, {}).get(name)
+            if prev is None:
+                continue
+            print("%-28s %12.2f %12.2f %8.2f" % ("%s/%s" % (group, name), prev["median"] * 1000,
+                                                 stats["median"] * 1000, stats["median"] / prev["median"]))
+
+
+def main(argv=sys.argv[1:]):
+    parser = argparse.ArgumentParser(description="GitPy benchmark suite")
+    synthetic.add_arguments(parser)
+    parser.add_argument("--repeat", type=int, default=5, help="Number of timed runs per benchmark.")
+    parser.add_argument("--only", choices=["isolated", "end_to_end"], help="Only run one group.")
+    parser.add_argument("--output", help="Write the results as JSON to this file.")
+    parser.add_argument("--compare", metavar="json", help="Compare with results from a previous run.")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "repo")
+        info = synthetic.generate_from_args(path, args)
+
+        results = {}
+        if args.only in (None, "isolated"):
+            results["isolated"] = isolated(path, info, args.repeat)
+        if args.only in (None, "end_to_end"):
+            results["end_to_end"] = end_to_end(path, info, args.repeat)
+
+    info.pop("paths")
+    report = {
+        "meta": {
+            "revision": revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repository": info,
+        },
+        "results": results,
+    }
+
+    for group, benchmarks in results.items():
+        for name, stats in benchmarks.items():
+            print("%-28s median %9.2f ms  min %9.2f ms" % ("%s/%s" % (group, name),
+                                                          stats["median"] * 1000, stats["min"] * 1000))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""Generates synthetic GitPy repositories for the benchmarks.
+
+Files are spread over a directory tree of configurable depth, with sizes drawn from a
+log-normal distribution, and the history is built by repeatedly modifying a fraction of
+the files and committing everything again. The same seed always generates the same
+repository.
+
+    python -m benchmarks.synthetic <path> [--files N] [--depth N] [--size BYTES] [--commits N]
+"""
+import argparse
+import contextlib
+import os
+import random
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+WORDS = [b"alpha", b"beta", b"gamma", b"delta", b"commit", b"tree", b"blob", b"index",
+         b"object", b"parent", b"author", b"hash", b"zlib", b"\n", b"\n", b"    "]
+
+
+@contextlib.contextmanager
+def chdir(path):
+    """GitPy resolves INDEX paths relative to the working directory, so commands must run from the worktree"""
+    old = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(old)
+
+
+def make_dirs(rnd, depth, fanout=4):
+    """Returns a list of relative directory paths, '' being the root, at most depth levels deep"""
+    dirs = [""]
+    level = [""]
+    for d in range(depth):
+        level = [os.path.join(parent, "d%d_%d" % (d, i)) for parent in level for i in range(fanout)]
+        # Keep the number of directories bounded for deep trees
+        if len(level) > 64:
+            level = rnd.sample(level, 64)
+        dirs.extend(level)
+    return dirs
+
+
+def make_content(rnd, size_mean, size_sigma):
+    """Returns text-like content with a log-normally distributed size"""
+    size = max(1, int(rnd.lognormvariate(0, size_sigma) * size_mean))
+    out = bytearray()
+    while len(out) < size:
+        out += rnd.choice(WORDS) + b" "
+    return bytes(out[:size])
+
+
+def generate_repo(path, files=100, depth=3, size_mean=2048, size_sigma=1.0, commits=5, churn=0.1,
+                  seed=0):
+    """Creates a repository at path with the given shape. Returns a dict describing it."""
+    import gitpy
+    from argparse import Namespace
+
+    rnd = random.Random(seed)
+    repo = gitpy.repo_init(path)
+
+    dirs = make_dirs(rnd, depth)
+    paths = sorted(os.path.join(rnd.choice(dirs), "f%d.txt" % i) for i in range(files))
+
+    total_bytes = 0
+    with chdir(path):
+        for p in paths:
+            directory = os.path.dirname(p)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            content = make_content(rnd, size_mean, size_sigma)
+            total_bytes += len(content)
+            with open(p, "wb") as f:
+                f.write(content)
+
+        for i in range(commits):
+            if i > 0:
+                for p in rnd.sample(paths, max(1, int(len(paths) * churn))):
+                    with open(p, "ab") as f:
+                        f.write(b"change %d\n" % i)
+
+            gitpy.update_index(*paths, repo=repo)
+            gitpy.commit(repo, Namespace(author="bench", committer="bench", message="Commit %d\n" % i))
+
+    return {
+        "files": files,
+        "depth": depth,
+        "size_mean": size_mean,
+        "size_sigma": size_sigma,
+        "commits": commits,
+        "churn": churn,
+        "seed": seed,
+        "bytes": total_bytes,
+        "paths": paths,
+    }
+
+
+def add_arguments(parser):
+    parser.add_argument("--files", type=int, default=100, help="Number of files.")
+    parser.add_argument("--depth", type=int, default=3, help="Maximum directory depth.")
+    parser.add_argument("--size", type=int, default=2048, help="Median file size in bytes.")
+    parser.add_argument("--size-sigma", type=float, default=1.0,
+                        help="Sigma of the log-normal file size distribution.")
+    parser.add_argument("--commits", type=int, default=5, help="Number of commits in the history.")
+    parser.add_argument("--churn", type=float, default=0.1,
+                        help="Fraction of the files modified by each commit.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+
+
+def generate_from_args(path, args):
+    return generate_repo(path, files=args.files, depth=args.depth, size_mean=args.size,
+                         size_sigma=args.size_sigma, commits=args.commits, churn=args.churn,
+                         seed=args.seed)
+
+
+def main(argv=sys.argv[1:]):
+    parser = argparse.ArgumentParser(description="Generate a synthetic GitPy repository")
+    parser.add_argument("path", help="Where to create the repository.")
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    info = generate_from_args(args.path, args)
+    print("Generated %d files (%d bytes) and %d commits in %s"
+          % (info["files"], info["bytes"], info["commits"], args.path))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+import hashlib
+import os
+import struct
+import tracing
+from objects import object_fmt, object_read, ref_list
+from util import LockFile, repo_file
+
+# Side file holding one changed-path Bloom filter per commit, written by `gitpy write-bloom`
+BLOOM_FILE = "path-filters"
+BLOOM_MAGIC = b'GPBF'
+BLOOM_VERSION = 1
+
+# Same parameters as git's changed-path filters: 10 bits per path and 7 hash functions
+BITS_PER_ENTRY = 10
+NUM_HASHES = 7
+# Commits changing more paths get an empty filter, which never rules anything out
+MAX_CHANGED_PATHS = 512
+
+
+class BloomFilter(object):
+    """A Bloom filter over paths. An empty filter matches every path."""
+
+    def __init__(self, data=b''):
+        self.data = bytearray(data)
+
+    @classmethod
+    def from_paths(cls, paths):
+        if len(paths) > MAX_CHANGED_PATHS:
+            return cls()
+
+        size = max(8, (len(paths) * BITS_PER_ENTRY + 7) // 8)
+        bloom = cls(bytes(size))
+        for path in paths:
+            bloom.add(path)
+        return bloom
+
+    def _positions(self, path):
+        digest = hashlib.blake2b(path.encode(), digest_size=8).digest()
+        h1 = int.from_bytes(digest[:4], "little")
+        h2 = int.from_bytes(digest[4:], "little") | 1
+        bits = len(self.data) * 8
+        return ((h1 + i * h2) % bits for i in range(NUM_HASHES))
+
+    def add(self, path):
+        for pos in self._positions(path):
+            self.data[pos >> 3] |= 1 << (pos & 7)
+
+    def might_contain(self, path):
+        if not self.data:
+            return True
+        return all(self.data[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(path))
+
+
+def commit_parents(commit):
+    parents = commit.kvlm.get(b'parent', [])
+    if type(parents) != list:
+        parents = [parents]
+    return [p.decode("ascii") for p in parents]
+
+
+def tree_items(tree):
+    """Returns {name: SHA} for a tree object, or {} for None"""
+    if tree is None:
+        return {}
+    return {leaf.path: leaf.sha for leaf in tree.items}
+
+
+def tree_or_none(repo, sha):
+    """Reads sha if it is a tree. Tree modes aren't reliable in GitPy, so the object type is checked,
+    from the header only so that changed blobs are never inflated."""
+    if sha is None or object_fmt(repo, sha) != b'tree':
+        return None
+    return object_read(repo, sha)
+
+
+@tracing.traced("tree_diff")
+def changed_paths(repo, commit):
+    """Returns the set of paths, directories included, that commit changed compared to its first parent"""
+    parents = commit_parents(commit)
+    parent_tree = None
+    if parents:
+        parent_tree = object_read(repo, object_read(repo, parents[0]).kvlm[b'tree'].decode("ascii"))
+    tree = object_read(repo, commit.kvlm[b'tree'].decode("ascii"))
+
+    changed = set()
+    stack = [("", parent_tree, tree)]
+    while stack:
+        prefix, old, new = stack.pop()
+        old_items = tree_items(old)
+        new_items = tree_items(new)
+
+        for name in set(old_items) | set(new_items):
+            old_sha = old_items.get(name)
+            new_sha = new_items.get(name)
+            if old_sha == new_sha:
+                continue
+
+            path = prefix + name
+            changed.add(path)
+
+            old_sub = tree_or_none(repo, old_sha)
+            new_sub = tree_or_none(repo, new_sha)
+            if old_sub or new_sub:
+                stack.append((path + "/", old_sub, new_sub))
+
+    return changed
+
+
+def commit_walk(repo, shas):
+    """Yields (sha, commit) for every commit reachable from shas, newest first on linear histories"""
+    seen = set()
+    stack = list(reversed(shas))
+    while stack:
+        sha = stack.pop()
+        if sha in seen:
+            continue
+        seen.add(sha)
+
+        commit = object_read(repo, sha)
+        yield sha, commit
+
+        stack.extend(reversed(commit_parents(commit)))
+
+
+def bloom_write(repo):
+    """Computes the changed-path filter of every commit reachable from the refs. Returns the number written."""
+    filters = {}
+    for sha, commit in commit_walk(repo, ref_list(repo)):
+        filters[sha] = BloomFilter.from_paths(changed_paths(repo, commit))
+
+    with LockFile(repo_file(repo, BLOOM_FILE), "wb") as f:
+        f.write(BLOOM_MAGIC + struct.pack(">BI", BLOOM_VERSION, len(filters)))
+        for sha in sorted(filters):
+            data = filters[sha].data
+            f.write(bytes.fromhex(sha) + struct.pack(">I", len(data)) + data)
+        f.commit()
+
+    return len(filters)
+
+
+def bloom_read(repo):
+    """Returns {commit SHA: BloomFilter} from the side file, {} if it hasn't been written"""
+    path = repo_file(repo, BLOOM_FILE)
+    if not path or not os.path.exists(path):
+        return {}
+
+    with open(path, "rb") as f:
+        raw = f.read()
+
+    if raw[0:4] != BLOOM_MAGIC:
+        raise Exception("Malformed Bloom filter file {0}".format(path))
+    version, count = struct.unpack(">BI", raw[4:9])
+    if version != BLOOM_VERSION:
+        raise Exception("Unsupported Bloom filter version {0}".format(version))
+
+    filters = {}
+    pos = 9
+    for _ in range(count):
+        sha = raw[pos:pos + 20].hex()
+        size, = struct.unpack(">I", raw[pos + 20:pos + 24])
+        filters[sha] = BloomFilter(raw[pos + 24:pos + 24 + size])
+        pos += 24 + size
+
+    return filters
+
+
+def path_normalize(path):
+    path = path.replace(os.sep, "/")
+    while path.startswith("./"):
+        path = path[2:]
+    path = path.strip("/")
+    return "" if path == "." else path
+
+
+def path_log(repo, sha, paths):
+    """Yields (sha, commit) for the commits reachable from sha that changed any of paths"""
+    paths = [path_normalize(p) for p in paths]
+    filters = bloom_read(repo)
+
+    for sha, commit in commit_walk(repo, [sha]):
+        bloom = filters.get(sha)
+        # The root directory isn't stored in the filters
+        if bloom is not None and all(p and not bloom.might_contain(p) for p in paths):
+            if tracing.enabled:
+                tracing.count("bloom_skipped")
+            continue
+
+        changed = changed_paths(repo, commit)
+        # An empty path is the root directory, which any change touches
+        if any(p in changed or (not p and changed) for p in paths):
+            yield sha, commit
+        elif bloom is not None and tracing.enabled:
+            tracing.count("bloom_false_positive")
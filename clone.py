@@ -0,0 +1,96 @@
+import configparser
+import errno
+import os
+import shutil
+import tracing
+from gitpy import repo_init
+from objects import object_iter, object_read, ref_resolve, tree_checkout
+from util import repo_dir, repo_file, repo_find
+
+# ioctl request to share the extents of a file on copy-on-write filesystems (btrfs, xfs), Linux only
+FICLONE = 0x40049409
+
+
+def file_reflink(src, dst):
+    """Copies src to dst sharing its blocks, raises OSError if the filesystem doesn't support it"""
+    import fcntl
+
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        try:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        except OSError:
+            d.close()
+            os.remove(dst)
+            raise
+
+
+def object_link(src, dst, hardlink=True):
+    """Shares the object file src with dst: hardlink, else reflink, else a plain copy.
+    Returns how it was done."""
+    if hardlink:
+        try:
+            os.link(src, dst)
+            return "linked"
+        except OSError as e:
+            # Other filesystem or no hardlink support
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+                raise
+
+    try:
+        file_reflink(src, dst)
+        return "reflinked"
+    except (OSError, ImportError):
+        shutil.copyfile(src, dst)
+        return "copied"
+
+
+@tracing.traced("clone")
+def clone(src, dst, hardlink=True, checkout=True):
+    """Clones the local repository at src into the new directory dst, sharing the object store
+    instead of hashing the files again. Returns the new repository."""
+    source = repo_find(src)
+    repo = repo_init(dst)
+
+    # Objects are never modified in place, so both repositories can share the same files
+    counts = {"linked": 0, "reflinked": 0, "copied": 0}
+    with tracing.span("link"):
+        for sha in object_iter(source):
+            path = repo_file(repo, "objects", sha[0:2], sha[2:], mkdir=True)
+            counts[object_link(repo_file(source, "objects", sha[0:2], sha[2:]), path, hardlink)] += 1
+
+    if tracing.enabled:
+        for how, n in counts.items():
+            tracing.count("objects_" + how, n)
+
+    # Refs and HEAD
+    refs = repo_dir(source, "refs")
+    for root, dirs, files in os.walk(refs):
+        for f in files:
+            if f.endswith(".lock"):
+                # Another process is updating the ref
+                continue
+            name = os.path.relpath(os.path.join(root, f), source.gitdir)
+            shutil.copyfile(os.path.join(root, f), repo_file(repo, *name.split(os.sep), mkdir=True))
+    shutil.copyfile(repo_file(source, "HEAD"), repo_file(repo, "HEAD"))
+
+    # Configuration, remembering where we cloned from
+    conf = configparser.ConfigParser()
+    conf.read([repo_file(source, "config")])
+    if not conf.has_section('remote "origin"'):
+        conf.add_section('remote "origin"')
+    conf.set('remote "origin"', "url", source.worktree)
+    with open(repo_file(repo, "config"), "w") as f:
+        conf.write(f)
+
+    repo = repo_find(dst)
+    if checkout:
+        try:
+            head = ref_resolve(repo, "HEAD")
+        except FileNotFoundError:
+            # Nothing committed yet
+            return repo
+
+        tree = object_read(repo, object_read(repo, head).kvlm[b'tree'].decode("ascii"))
+        tree_checkout(repo, tree, repo.worktree.encode())
+
+    return repo
@@ -0,0 +1,133 @@
+import hashlib
+import multiprocessing
+import os
+import sys
+import time
+import zlib
+from gitpy import index_list
+from objects import object_iter, object_links, ref_list
+from util import repo_dir
+
+# Number of objects handed to a worker at a time
+CHUNK_SIZE = 256
+
+
+def object_check(objects_dir, sha):
+    """Verifies a loose object. Returns (sha, fmt, shas it references, error or None)."""
+    path = os.path.join(objects_dir, sha[0:2], sha[2:])
+
+    try:
+        with open(path, "rb") as f:
+            raw = zlib.decompress(f.read())
+    except (OSError, zlib.error) as e:
+        return sha, None, (), "unreadable ({0})".format(e)
+
+    if hashlib.sha1(raw).hexdigest() != sha:
+        return sha, None, (), "hash mismatch"
+
+    x = raw.find(b' ')
+    y = raw.find(b'\x00', x)
+    if x < 0 or y < 0:
+        return sha, None, (), "malformed header"
+
+    fmt = raw[0:x]
+    try:
+        size = int(raw[x:y].decode("ascii"))
+    except ValueError:
+        return sha, None, (), "malformed header"
+    if size != len(raw) - y - 1:
+        return sha, fmt, (), "bad length"
+
+    data = raw[y + 1:]
+    if fmt not in (b'blob', b'tree', b'commit', b'tag'):
+        return sha, fmt, (), "unknown type"
+
+    try:
+        links = object_links(fmt, data)
+    except Exception as e:
+        return sha, fmt, (), "unparseable ({0})".format(e)
+
+    return sha, fmt, links, None
+
+
+def _object_check(args):
+    return object_check(*args)
+
+
+def fsck(repo, jobs=None, progress=True, out=sys.stdout, err=sys.stderr):
+    """Verifies the hash of every object in parallel, then walks reachability from the refs and INDEX.
+    Returns a dict with the corrupt, missing and dangling SHAs."""
+    objects_dir = repo_dir(repo, "objects")
+    tasks = ((objects_dir, sha) for sha in object_iter(repo))
+
+    present = {}
+    links = {}
+    referenced = set()
+    corrupt = []
+
+    if jobs == 1:
+        pool = None
+        results = map(_object_check, tasks)
+    else:
+        pool = multiprocessing.Pool(jobs)
+        results = pool.imap_unordered(_object_check, tasks, CHUNK_SIZE)
+
+    checked = 0
+    last = time.monotonic()
+    try:
+        for sha, fmt, children, error in results:
+            checked += 1
+            if error:
+                corrupt.append(sha)
+                out.write("corrupt {0} {1}: {2}\n".format((fmt or b'object').decode("ascii", "replace"),
+                                                         sha, error))
+            else:
+                present[sha] = fmt
+                if children:
+                    links[sha] = children
+                    referenced.update(children)
+
+            if progress and time.monotonic() - last > 0.5:
+                last = time.monotonic()
+                err.write("Checking objects: {0}\r".format(checked))
+                err.flush()
+    except BaseException:
+        # Ctrl-C or an error: don't wait for the rest of the object store to be hashed
+        if pool:
+            pool.terminate()
+        raise
+    else:
+        if pool:
+            pool.close()
+    finally:
+        if pool:
+            pool.join()
+
+    if progress:
+        err.write("Checking objects: {0}, done.\n".format(checked))
+
+    # Iterative walk so that long histories and deep trees can't hit the recursion limit
+    corrupt_set = set(corrupt)
+    reachable = set()
+    missing = []
+    stack = ref_list(repo) + index_list(repo)
+    while stack:
+        sha = stack.pop()
+        if sha in reachable:
+            continue
+        reachable.add(sha)
+
+        if sha not in present:
+            if sha not in corrupt_set:
+                missing.append(sha)
+                out.write("missing object {0}\n".format(sha))
+            continue
+
+        stack.extend(links.get(sha, ()))
+
+    # Like git, only report the unreachable objects no other object points to
+    dangling = sorted(sha for sha in present if sha not in reachable and sha not in referenced)
+    for sha in dangling:
+        out.write("dangling {0} {1}\n".format(present[sha].decode("ascii"), sha))
+
+    return {"corrupt": corrupt, "missing": missing, "dangling": dangling}
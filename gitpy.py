@@ -1,7 +1,6 @@
-import configparser
+import os
+import tracing
 from objects import *
-from io import BytesIO
-import tempfile
 
 
 class GitPyRepository(object):
@@ -18,6 +17,8 @@ class GitPyRepository(object):
             if not os.path.isdir(self.gitdir):
                 raise Exception("No GitPy repository present at given location!")
 
+            import configparser
+
             # Read configuration file in .git/config
             self.conf = configparser.ConfigParser()
             cf = repo_file(self, "config")
@@ -65,6 +66,8 @@ def repo_init(path):
 
 def repo_default_config():
     """Creates the default configuration for GitPy"""
+    import configparser
+
     ret = configparser.ConfigParser()
 
     ret.add_section("core")
@@ -75,21 +78,42 @@ def repo_default_config():
 
 # Everything below this line was written by Jakob Philippe #
 
+@tracing.traced("update_index")
 def update_index(*files, repo):
     """Adds given files to the INDEX git staging file for future commit"""
-    idx = parse_index(repo)
+    shas = {}
     for f in files:
         path = f
         sha = None
         with open(path, "rb") as fd:
             sha = object_hash(fd, b'blob', repo)
 
-        idx[path] = sha
+        shas[path] = sha
+
+    # Only hold the lock while merging, so that concurrent adds can hash their files in parallel
+    with LockFile(repo_file(repo, "INDEX", mkdir=True)) as index:
+        idx = parse_index(repo)
+        idx.update(shas)
+        index_write(index, idx)
+        index.commit()
+
+
+def index_write(index, idx):
+    """Writes the parsed INDEX idx to the file object index"""
+    for key in idx:
+        index.write(idx[key] + " ")
+        index.write(key + "\n")
+
 
-    with open(repo_file(repo, "INDEX", mkdir=True), "w") as index:
-        for key in idx:
-            index.write(idx[key] + " ")
-            index.write(key + "\n")
+def index_remove(repo, entries):
+    """Removes the given {path: sha} entries from INDEX, keeping those that were staged again since"""
+    with LockFile(repo_file(repo, "INDEX", mkdir=True)) as index:
+        idx = parse_index(repo)
+        for path, sha in entries.items():
+            if idx.get(path) == sha:
+                del idx[path]
+        index_write(index, idx)
+        index.commit()
 
 
 def parse_index(repo):
@@ -106,15 +130,23 @@ def parse_index(repo):
     return idx
 
 
-def tree_from_index(repo):
+def index_list(repo):
+    """Returns the SHAs of the blobs staged in INDEX"""
+    return list(parse_index(repo).values())
+
+
+@tracing.traced("tree_from_index")
+def tree_from_index(repo, idx=None):
     """Algorithm to build commit tree from staged files"""
-    idx = parse_index(repo)
+    if idx is None:
+        idx = parse_index(repo)
 
     # If index is empty return
     if not idx:
         raise IndexHasNoValues()
 
-    hashmap = {}
+    # Always include the root directory, even if every staged file is in a subdirectory
+    hashmap = {'': []}
 
     # Create a dictionary of directories and files nested like a file system
     for key in idx:
@@ -185,49 +217,69 @@ def tree_from_index(repo):
                     hashmap[''] = []
                 hashmap[''].append({tree_sha: dir})
 
-        return tree_shas
+    return tree_shas
+
+
+# Number of times commit is redone when another process commits at the same time
+COMMIT_RETRIES = 10
 
 
 def commit(repo, args):
     """Create a commit with given arguments based off the tree of the staging area INDEX file"""
+    idx = parse_index(repo)
     try:
         # Grab the tree of the current staging index
         # The last item is the root tree
-        tree_sha = tree_from_index(repo)[-1]
+        tree_sha = tree_from_index(repo, idx)[-1]
     except IndexHasNoValues:
         print("You must add files to the index using the add command before committing!")
         return
 
-    # Check if anything in the current staging area has changed, if not return
-    # Check if there is an INDEX file, in the case there is not return
-    try:
-        parent = ref_resolve(repo, "HEAD")
-        commitPrevTree = object_read(repo, parent).kvlm[b'tree'].decode()
-
-        if tree_sha == commitPrevTree:
-            print("Nothing has changed since the previous commit!")
-            return
-
-    except FileNotFoundError:
-        parent = None
-
-    # Create commit file, update HEAD, and clear staging INDEX
-
-    commit_data = ""
-
-    commit_data += "tree " + tree_sha + "\n"
-    if parent:
-        commit_data += "parent " + parent + "\n"
-    commit_data += "author " + args.author + "\n"
-    commit_data += "commiter " + args.committer + "\n\n"
-    commit_data += args.message
-
-    commit_sha = object_write(GitPyCommit(repo, commit_data.encode()), True)
-
-    with open(repo_file(repo, "refs/heads/master", mkdir=True), "w") as master:
-        master.write(commit_sha)
+    for attempt in range(COMMIT_RETRIES):
+        # Check if anything in the current staging area has changed, if not return
+        # Check if there is an INDEX file, in the case there is not return
+        try:
+            parent = ref_resolve(repo, "HEAD")
+            commitPrevTree = object_read(repo, parent).kvlm[b'tree'].decode()
+
+            if tree_sha == commitPrevTree:
+                print("Nothing has changed since the previous commit!")
+                return
+
+        except FileNotFoundError:
+            parent = None
+
+        # Create commit file, update HEAD, and clear staging INDEX
+
+        commit_data = ""
+
+        commit_data += "tree " + tree_sha + "\n"
+        if parent:
+            commit_data += "parent " + parent + "\n"
+        commit_data += "author " + args.author + "\n"
+        commit_data += "commiter " + args.committer + "\n\n"
+        commit_data += args.message
+
+        commit_sha = object_write(GitPyCommit(repo, commit_data.encode()), True)
+
+        try:
+            ref_update(repo, "refs/heads/master", commit_sha, parent)
+            break
+        except RefConflict:
+            # Another process committed since we read HEAD, redo the commit on top of theirs. If the ref
+            # hasn't actually moved, retrying can't help.
+            try:
+                moved = ref_resolve(repo, "HEAD") != parent
+            except FileNotFoundError:
+                moved = parent is not None
+            if not moved:
+                raise
+            continue
+    else:
+        raise Exception("Unable to update refs/heads/master, too many concurrent commits!")
 
-    open(repo_file(repo, "INDEX", mkdir=True), "w")
+    # Files staged again since we read the INDEX stay staged
+    index_remove(repo, idx)
 
 
 class IndexHasNoValues(Exception):
@@ -1,67 +1,116 @@
 import argparse
-import gitpy
-from gitpy import *
+import os
 import sys
-from util import repo_find
-from objects import object_hash, object_read, object_find
 
-argparser = argparse.ArgumentParser(description="Argparse for GitPy")
-argsubparsers = argparser.add_subparsers(title="Commands", dest="command")
-argsubparsers.required = True
+# Heavy modules (gitpy, objects) are imported inside the cmd_* functions so
+# that only the command actually run pays for them.
 
 
-def main(argv=sys.argv[1:]):
-    args = argparser.parse_args(argv)
+def positive_int(value):
+    """argparse type for counts that must be at least 1"""
+    try:
+        n = int(value)
+    except ValueError:
+        n = 0
+    if n < 1:
+        raise argparse.ArgumentTypeError("must be a positive integer, not {0}".format(value))
+    return n
+
+
+def build_parser(names=None):
+    """Builds the argument parser, registering only the given subcommands (all of them by default)"""
+    argparser = argparse.ArgumentParser(description="Argparse for GitPy")
+    argparser.add_argument("--trace",
+                           metavar="file",
+                           help="Write performance tracing to <file> ('-' for stderr). Also set by GITPY_TRACE.")
+    argparser.add_argument("--trace-format",
+                           choices=["summary", "chrome"],
+                           help="JSON summary of timings and counters, or Chrome trace events.")
+
+    argsubparsers = argparser.add_subparsers(title="Commands", dest="command")
+    argsubparsers.required = True
 
-    if args.command == "init":
-        cmd_init(args)
-    elif args.command == "hash-object":
-        cmd_hash_object(args)
-    elif args.command == "cat-file":
-        cmd_cat_file(args)
-    elif args.command == "add":
-        cmd_add(args)
-    elif args.command == "commit":
-        cmd_commit(args)
-    elif args.command == "checkout":
-        cmd_checkout(args)
-    elif args.command == "log":
-        cmd_log(args)
+    for name in names or commands:
+        help, add_arguments, _ = commands[name]
+        add_arguments(argsubparsers.add_parser(name, help=help))
 
+    return argparser
 
-argsp = argsubparsers.add_parser("init", help="Initialize a new, empty repository.")
 
-argsp.add_argument("path",
-                   metavar="directory",
-                   nargs="?",
-                   default=".",
-                   help="Where to create the repository.")
+def command_name(argv):
+    """Returns the subcommand in argv, skipping the global options before it"""
+    args = iter(argv)
+    for arg in args:
+        if arg in ("--trace", "--trace-format"):
+            next(args, None)
+        elif not arg.startswith("-"):
+            return arg
+    return None
+
+
+def main(argv=sys.argv[1:]):
+    # Skip building every subparser when the command is already known
+    name = command_name(argv)
+    names = [name] if name in commands else None
+
+    # For log, everything after -- is a list of paths, like in git. Other commands keep the usual
+    # meaning of --, which lets positional arguments start with a dash.
+    paths = None
+    if name == "log" and "--" in argv:
+        i = argv.index("--")
+        argv, paths = argv[:i], argv[i + 1:]
+
+    args = build_parser(names).parse_args(argv)
+    if paths is not None:
+        args.paths = paths
+
+    trace = args.trace or os.environ.get("GITPY_TRACE")
+    if not trace:
+        commands[args.command][2](args)
+        return
+
+    import tracing
+    tracing.start(trace, args.trace_format)
+    try:
+        commands[args.command][2](args)
+    finally:
+        tracing.stop()
+
+
+def args_init(argsp):
+    argsp.add_argument("path",
+                       metavar="directory",
+                       nargs="?",
+                       default=".",
+                       help="Where to create the repository.")
 
 
 def cmd_init(args):
-    repo_init(args.path)
+    from gitpy import repo_init
 
+    repo_init(args.path)
 
-argsp = argsubparsers.add_parser(
-    "hash-object",
-    help="Compute object ID and optionally creates a blob from a file")
 
-argsp.add_argument("-t",
-                   metavar="type",
-                   dest="type",
-                   choices=["blob", "commit", "tag", "tree"],
-                   default="blob",
-                   help="Specify the type")
+def args_hash_object(argsp):
+    argsp.add_argument("-t",
+                       metavar="type",
+                       dest="type",
+                       choices=["blob", "commit", "tag", "tree"],
+                       default="blob",
+                       help="Specify the type")
 
-argsp.add_argument("-w",
-                   dest="write",
-                   action="store_true",
-                   help="Actually write the object into the database")
+    argsp.add_argument("-w",
+                       dest="write",
+                       action="store_true",
+                       help="Actually write the object into the database")
 
-argsp.add_argument("path", help="Read object from <file>")
+    argsp.add_argument("path", help="Read object from <file>")
 
 
 def cmd_hash_object(args):
+    from objects import object_hash
+    from util import repo_find
+
     if args.write:
         repo = repo_find(path=args.path)
     else:
@@ -72,29 +121,32 @@ def cmd_hash_object(args):
         print(sha)
 
 
-argsp = argsubparsers.add_parser("cat-file", help="Provide content of repository objects")
-
-argsp.add_argument("type",
-                   metavar="type",
-                   choices=["blob", "commit", "tag", "tree"],
-                   help="Specify the type")
+def args_cat_file(argsp):
+    argsp.add_argument("type",
+                       metavar="type",
+                       choices=["blob", "commit", "tag", "tree"],
+                       help="Specify the type")
 
-argsp.add_argument("object",
-                   metavar="object",
-                   help="The object to display")
+    argsp.add_argument("object",
+                       metavar="object",
+                       help="The object to display")
 
-argsp.add_argument("path",
-                   metavar="path",
-                   default=".",
-                   help="Path to the repository")
+    argsp.add_argument("path",
+                       metavar="path",
+                       default=".",
+                       help="Path to the repository")
 
 
 def cmd_cat_file(args):
+    from util import repo_find
+
     repo = repo_find(args.path)
     cat_file(repo, args.object, fmt=args.type.encode())
 
 
 def cat_file(repo, obj, fmt=None):
+    from objects import object_find, object_read
+
     if fmt == b'tree':
         tree = object_find(repo, obj, b'tree')
         tree = object_read(repo, tree)
@@ -108,20 +160,22 @@ def cat_file(repo, obj, fmt=None):
         sys.stdout.buffer.write(obj.serialize())
 
 
-argsp = argsubparsers.add_parser("add", help="Add files to the staging area.")
+def args_add(argsp):
+    argsp.add_argument("-a",
+                       dest="add_all",
+                       action="store_true",
+                       help="Add all untracked files to staging area.")
 
-argsp.add_argument("-a",
-                   dest="add_all",
-                   action="store_true",
-                   help="Add all untracked files to staging area.")
-
-argsp.add_argument("--path",
-                   metavar="path",
-                   required='-a' not in sys.argv,
-                   help="Path to the file.")
+    argsp.add_argument("--path",
+                       metavar="path",
+                       required='-a' not in sys.argv,
+                       help="Path to the file.")
 
 
 def cmd_add(args):
+    from gitpy import update_index
+    from util import get_files, repo_find
+
     path = "." if args.path is None else args.path
     repo = repo_find(path)
 
@@ -138,40 +192,44 @@ def cmd_add(args):
             update_index(file, repo=repo)
 
 
-argsp = argsubparsers.add_parser("commit", help="Commit files in the staging area to the local repository.")
-
-argsp.add_argument("author",
-                   help="Author's name.")
+def args_commit(argsp):
+    argsp.add_argument("author",
+                       help="Author's name.")
 
-argsp.add_argument("committer",
-                   help="Committer's name.")
+    argsp.add_argument("committer",
+                       help="Committer's name.")
 
-argsp.add_argument("message",
-                   help="Commit message.")
+    argsp.add_argument("message",
+                       help="Commit message.")
 
-argsp.add_argument("--path",
-                   metavar="path",
-                   required=False,
-                   help="Path in repository.")
+    argsp.add_argument("--path",
+                       metavar="path",
+                       required=False,
+                       help="Path in repository.")
 
 
 def cmd_commit(args):
+    from gitpy import commit
+    from util import repo_find
+
     path = "." if args.path is None else args.path
     repo = repo_find(path)
 
     commit(repo, args)
 
 
-argsp = argsubparsers.add_parser("checkout", help="Checkout a commit inside of a directory.")
-
-argsp.add_argument("commit",
-                   help="The commit or tree to checkout.")
+def args_checkout(argsp):
+    argsp.add_argument("commit",
+                       help="The commit or tree to checkout.")
 
-argsp.add_argument("path",
-                   help="The EMPTY directory to checkout on.")
+    argsp.add_argument("path",
+                       help="The EMPTY directory to checkout on.")
 
 
 def cmd_checkout(args):
+    from objects import object_find, object_read, tree_checkout
+    from util import repo_find
+
     repo = repo_find()
 
     obj = object_read(repo, object_find(repo, args.commit))
@@ -192,15 +250,20 @@ def cmd_checkout(args):
     tree_checkout(repo, obj, os.path.realpath(args.path).encode())
 
 
-argsp = argsubparsers.add_parser("log", help="Display history of a given commit.")
+def args_log(argsp):
+    argsp.add_argument("commit",
+                       default="HEAD",
+                       nargs="?",
+                       help="Commit to start at.")
 
-argsp.add_argument("commit",
-                   default="HEAD",
-                   nargs="?",
-                   help="Commit to start at.")
+    # Filled with the paths after --, see main
+    argsp.set_defaults(paths=[])
 
 
 def cmd_log(args):
+    from objects import object_find
+    from util import repo_find
+
     repo = repo_find()
     try:
         obj = object_find(repo, args.commit)
@@ -208,12 +271,20 @@ def cmd_log(args):
         print("No commits to view")
         return
 
+    if args.paths:
+        from bloom import path_log
+
+        for sha, commit in path_log(repo, obj, args.paths):
+            print(sha, commit.kvlm[b''].decode("utf-8", "replace").split("\n")[0])
+        return
+
     print("digraph wyaglog{")
     log_graphviz(repo, obj, set())
     print("}")
 
 
 def log_graphviz(repo, sha, seen):
+    from objects import object_read
 
     if sha in seen:
         return
@@ -235,4 +306,180 @@ def log_graphviz(repo, sha, seen):
     for p in parents:
         p = p.decode("ascii")
         print ("c_{0} -> c_{1};".format(sha, p))
-        log_graphviz(repo, p, seen)
\ No newline at end of file
+        log_graphviz(repo, p, seen)
+
+
+def args_fsck(argsp):
+    argsp.add_argument("-j", "--jobs",
+                       type=positive_int,
+                       default=None,
+                       help="Number of worker processes (default: one per core).")
+
+    argsp.add_argument("--no-progress",
+                       dest="progress",
+                       action="store_false",
+                       help="Don't report progress on stderr.")
+
+
+def cmd_fsck(args):
+    from fsck import fsck
+    from util import repo_find
+
+    repo = repo_find()
+    result = fsck(repo, jobs=args.jobs, progress=args.progress)
+
+    if result["corrupt"] or result["missing"]:
+        sys.exit(1)
+
+
+def args_gc(argsp):
+    argsp.add_argument("--prune",
+                       metavar="age",
+                       default=None,
+                       help="Prune unreachable objects older than <age>, e.g. 'now', 'never', '1.day.ago'. "
+                            "Defaults to prune.DEFAULT_PRUNE.")
+
+    argsp.add_argument("-n", "--dry-run",
+                       dest="dry_run",
+                       action="store_true",
+                       help="List the objects that would be pruned without deleting them.")
+
+
+def cmd_gc(args):
+    from prune import DEFAULT_PRUNE, CorruptObject, parse_age, prune
+    from util import repo_find
+
+    repo = repo_find()
+    try:
+        count = prune(repo, parse_age(args.prune or DEFAULT_PRUNE), dry_run=args.dry_run,
+                      out=sys.stdout if args.dry_run else None)
+    except CorruptObject as e:
+        # On stderr, so that it doesn't mix with the SHAs listed by --dry-run
+        print(e, file=sys.stderr)
+        sys.exit(1)
+
+    if args.dry_run:
+        print("Would prune {0} objects".format(count))
+    else:
+        print("Pruned {0} objects".format(count))
+
+
+def args_write_bloom(argsp):
+    pass
+
+
+def cmd_write_bloom(args):
+    from bloom import bloom_write
+    from util import repo_find
+
+    repo = repo_find()
+    print("Wrote changed-path filters for {0} commits".format(bloom_write(repo)))
+
+
+def args_clone(argsp):
+    argsp.add_argument("source",
+                       help="Path of the local repository to clone.")
+
+    argsp.add_argument("directory",
+                       help="The new, EMPTY directory to clone into.")
+
+    argsp.add_argument("--no-hardlinks",
+                       dest="hardlink",
+                       action="store_false",
+                       help="Copy the objects (reflinked when possible) instead of hardlinking them.")
+
+    argsp.add_argument("--no-checkout",
+                       dest="checkout",
+                       action="store_false",
+                       help="Don't checkout HEAD in the new repository.")
+
+
+def cmd_clone(args):
+    from clone import clone
+
+    clone(args.source, args.directory, hardlink=args.hardlink, checkout=args.checkout)
+
+
+def args_grep(argsp):
+    argsp.add_argument("pattern",
+                       help="Regular expression to search for.")
+
+    argsp.add_argument("commit",
+                       default="HEAD",
+                       nargs="?",
+                       help="Commit or tree to search.")
+
+    argsp.add_argument("--cached",
+                       action="store_true",
+                       help="Search the files staged in the INDEX instead of a commit.")
+
+    argsp.add_argument("-i", "--ignore-case",
+                       dest="ignore_case",
+                       action="store_true",
+                       help="Ignore case differences.")
+
+    argsp.add_argument("-n", "--line-number",
+                       dest="line_numbers",
+                       action="store_true",
+                       help="Prefix matching lines with their line number.")
+
+    argsp.add_argument("-l", "--files-with-matches",
+                       dest="files_only",
+                       action="store_true",
+                       help="Only print the paths of the matching files.")
+
+    argsp.add_argument("-j", "--jobs",
+                       type=positive_int,
+                       default=None,
+                       help="Number of worker processes (default: one per core).")
+
+
+def cmd_grep(args):
+    import re
+    from grep import grep, index_blobs, tree_blobs
+    from objects import object_find
+    from util import repo_find
+
+    repo = repo_find()
+    if args.cached:
+        blobs = index_blobs(repo)
+    else:
+        try:
+            blobs = tree_blobs(repo, object_find(repo, args.commit, b'tree'))
+        except FileNotFoundError:
+            print("No commits to search")
+            return
+
+    try:
+        found = grep(repo, args.pattern, blobs, ignore_case=args.ignore_case, line_numbers=args.line_numbers,
+                     files_only=args.files_only, jobs=args.jobs)
+    except re.error as e:
+        print("Invalid pattern {0}: {1}".format(args.pattern, e), file=sys.stderr)
+        sys.exit(2)
+    except BrokenPipeError:
+        # Output closed early, e.g. piped into head. Point stdout at devnull so that flushing it on exit
+        # doesn't fail again.
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(1)
+
+    if not found:
+        sys.exit(1)
+
+
+# Subcommand name -> (help, function adding its arguments, function running it)
+commands = {
+    "init": ("Initialize a new, empty repository.", args_init, cmd_init),
+    "hash-object": ("Compute object ID and optionally creates a blob from a file", args_hash_object, cmd_hash_object),
+    "cat-file": ("Provide content of repository objects", args_cat_file, cmd_cat_file),
+    "add": ("Add files to the staging area.", args_add, cmd_add),
+    "commit": ("Commit files in the staging area to the local repository.", args_commit, cmd_commit),
+    "checkout": ("Checkout a commit inside of a directory.", args_checkout, cmd_checkout),
+    "log": ("Display history of a given commit, or with -- <path>... the commits changing those paths.",
+            args_log, cmd_log),
+    "fsck": ("Verify the integrity and reachability of the objects.", args_fsck, cmd_fsck),
+    "gc": ("Delete unreachable objects.", args_gc, cmd_gc),
+    "grep": ("Search the files of a commit or of the INDEX for a pattern.", args_grep, cmd_grep),
+    "clone": ("Clone a local repository into a new directory.", args_clone, cmd_clone),
+    "write-bloom": ("Precompute the changed-path Bloom filters used by log -- <path>.",
+                    args_write_bloom, cmd_write_bloom),
+}
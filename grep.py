@@ -0,0 +1,122 @@
+import multiprocessing
+import os
+import re
+import sys
+import tracing
+import zlib
+from objects import object_fmt, object_read
+from util import repo_dir
+
+# Like git, a blob with a NUL byte in its first 8000 bytes is binary and not searched
+BINARY_CHECK_SIZE = 8000
+# Number of blobs handed to a worker at a time
+CHUNK_SIZE = 16
+
+
+def blob_grep(objects_dir, sha, pattern, flags, files_only):
+    """Searches a blob for the bytes regex pattern. Returns (sha, [(line number, line)], binary)."""
+    with open(os.path.join(objects_dir, sha[0:2], sha[2:]), "rb") as f:
+        raw = zlib.decompress(f.read())
+    data = raw[raw.find(b'\x00') + 1:]
+
+    if b'\x00' in data[:BINARY_CHECK_SIZE]:
+        return sha, [], True
+
+    regex = re.compile(pattern, flags)
+    matches = []
+    # Always matched line by line: a search over the whole blob disagrees with it on anchors and
+    # lookarounds like \A or (?<!\n)
+    for i, line in enumerate(data.split(b'\n'), 1):
+        if regex.search(line):
+            matches.append((i, line))
+            if files_only:
+                break
+
+    return sha, matches, False
+
+
+def _blob_grep(args):
+    return blob_grep(*args)
+
+
+def tree_blobs(repo, sha):
+    """Returns {blob SHA: [paths]} for every file in the tree sha, so identical blobs are searched once"""
+    blobs = {}
+    stack = [("", sha)]
+    while stack:
+        prefix, sha = stack.pop()
+        for leaf in object_read(repo, sha).items:
+            path = prefix + leaf.path
+            # Tree modes aren't reliable in GitPy, so check the object type
+            if object_fmt(repo, leaf.sha) == b'tree':
+                stack.append((path + "/", leaf.sha))
+            else:
+                blobs.setdefault(leaf.sha, []).append(path)
+    return blobs
+
+
+def index_blobs(repo):
+    """Returns {blob SHA: [paths]} for the files staged in INDEX"""
+    from gitpy import parse_index
+
+    blobs = {}
+    for path, sha in parse_index(repo).items():
+        blobs.setdefault(sha, []).append(path)
+    return blobs
+
+
+@tracing.traced("grep")
+def grep(repo, pattern, blobs, ignore_case=False, line_numbers=False, files_only=False, jobs=None,
+         out=sys.stdout):
+    """Searches the {blob SHA: [paths]} blobs for the regular expression pattern in a pool of workers,
+    writing matches as they are found. Returns the number of matching files."""
+    flags = re.IGNORECASE if ignore_case else 0
+    pattern = pattern.encode()
+    # Fail early on an invalid pattern rather than in every worker
+    re.compile(pattern, flags)
+
+    objects_dir = repo_dir(repo, "objects")
+    tasks = ((objects_dir, sha, pattern, flags, files_only) for sha in blobs)
+
+    if jobs == 1:
+        pool = None
+        results = map(_blob_grep, tasks)
+    else:
+        pool = multiprocessing.Pool(jobs)
+        results = pool.imap_unordered(_blob_grep, tasks, CHUNK_SIZE)
+
+    found = 0
+    try:
+        for sha, matches, binary in results:
+            if tracing.enabled:
+                tracing.count("blobs_searched")
+                if binary:
+                    tracing.count("blobs_binary")
+            if not matches:
+                continue
+
+            for path in sorted(blobs[sha]):
+                found += 1
+                if files_only:
+                    out.write(path + "\n")
+                    continue
+                for lineno, line in matches:
+                    line = line.decode("utf-8", "replace")
+                    if line_numbers:
+                        out.write("{0}:{1}:{2}\n".format(path, lineno, line))
+                    else:
+                        out.write("{0}:{1}\n".format(path, line))
+            out.flush()
+    except BaseException:
+        # Ctrl-C, a closed pipe or an error: don't wait for the rest of the blobs to be searched
+        if pool:
+            pool.terminate()
+        raise
+    else:
+        if pool:
+            pool.close()
+    finally:
+        if pool:
+            pool.join()
+
+    return found
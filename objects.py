@@ -1,6 +1,8 @@
 import collections
 import hashlib
+import os
 import re
+import tracing
 import zlib
 from util import *
 
@@ -48,32 +50,68 @@ def object_hash(fd, fmt, repo=None):
     return object_write(obj)
 
 
+# Objects are written to objects/<prefix><random> then renamed into place
+TMP_OBJECT_PREFIX = "tmp_obj_"
+
+
+@tracing.traced("object_write")
 def object_write(obj, actually_write=True):
     # Serialize object data
     data = obj.serialize()
     # Add header
     result = obj.fmt + b' ' + str(len(data)).encode() + b'\x00' + data
     # Compute hash
-    sha = hashlib.sha1(result).hexdigest()
+    with tracing.span("hash"):
+        sha = hashlib.sha1(result).hexdigest()
 
     if actually_write:
         # Compute path
         path = repo_file(obj.repo, "objects", sha[0:2], sha[2:], mkdir=actually_write)
 
-        with open(path, 'wb') as f:
-            # Compress and write
-            f.write(zlib.compress(result))
+        # Objects never change, so if it exists only refresh the mtime so that gc considers it recent
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # Not written yet, or pruned by gc in the meantime
+            pass
+        else:
+            if tracing.enabled:
+                tracing.count("objects_existing")
+            return sha
+
+        # Compress and write
+        with tracing.span("compress"):
+            compressed = zlib.compress(result)
+
+        # Write to a temporary file first so that concurrent readers never see a partial object
+        tmp = repo_file(obj.repo, "objects", TMP_OBJECT_PREFIX + os.urandom(8).hex())
+        with open(tmp, 'wb') as f:
+            f.write(compressed)
+        os.replace(tmp, path)
+
+        if tracing.enabled:
+            tracing.count("objects_written")
+            tracing.count("bytes_compressed", len(result))
+            tracing.count("bytes_written", len(compressed))
 
     return sha
 
 
+@tracing.traced("object_read")
 def object_read(repo, sha):
     """Read object object_id from Git repository repo.  Return a
     GitObject whose exact type depends on the object."""
     path = repo_file(repo, "objects", sha[0:2], sha[2:])
 
     with open(path, "rb") as f:
-        raw = zlib.decompress(f.read())
+        compressed = f.read()
+        with tracing.span("decompress"):
+            raw = zlib.decompress(compressed)
+
+        if tracing.enabled:
+            tracing.count("objects_read")
+            tracing.count("bytes_read", len(compressed))
+            tracing.count("bytes_decompressed", len(raw))
 
         # Read object type
         x = raw.find(b' ')
@@ -98,6 +136,26 @@ def object_read(repo, sha):
         return c(repo, raw[y + 1:])
 
 
+def object_fmt(repo, sha):
+    """Returns the type of an object, only reading and decompressing the start of it"""
+    with open(repo_file(repo, "objects", sha[0:2], sha[2:]), "rb") as f:
+        header = zlib.decompressobj().decompress(f.read(1024), 64)
+    return header[0:header.find(b' ')]
+
+
+def object_iter(repo):
+    """Yields the SHA of every loose object in the repository, in sorted order"""
+    path = repo_dir(repo, "objects")
+    if path is None:
+        return
+
+    for prefix in sorted(os.listdir(path)):
+        if len(prefix) != 2 or not os.path.isdir(os.path.join(path, prefix)):
+            continue
+        for name in sorted(os.listdir(os.path.join(path, prefix))):
+            yield prefix + name
+
+
 def ref_resolve(repo, ref):
     with open(repo_file(repo, ref), 'r') as fp:
         data = fp.read()
@@ -107,7 +165,59 @@ def ref_resolve(repo, ref):
     if data.startswith("ref: "):
         return ref_resolve(repo, data[5:])
     else:
-        return data
+        # A SHA written by another tool may end with a newline too
+        return data.strip()
+
+
+def ref_list(repo):
+    """Returns the SHAs that HEAD and every ref under refs/ point to"""
+    shas = []
+    names = ["HEAD"]
+
+    refs = repo_dir(repo, "refs")
+    if refs:
+        for root, dirs, files in os.walk(refs):
+            for f in files:
+                if f.endswith(".lock"):
+                    # Another process is updating the ref
+                    continue
+                names.append(os.path.relpath(os.path.join(root, f), repo.gitdir))
+
+    for name in names:
+        try:
+            sha = ref_resolve(repo, name).strip()
+        except FileNotFoundError:
+            # HEAD points to a branch without commits
+            continue
+        if sha:
+            shas.append(sha)
+
+    return shas
+
+
+class RefConflict(Exception):
+    pass
+
+
+def ref_update(repo, ref, new, old=None):
+    """Points ref to new, provided it still points to old (None meaning that it must not exist yet).
+    Raises RefConflict if another process moved it in the meantime."""
+    path = repo_file(repo, *ref.split("/"), mkdir=True)
+
+    with LockFile(path) as lock:
+        try:
+            with open(path, "r") as fp:
+                current = fp.read().strip()
+        except FileNotFoundError:
+            current = None
+
+        if old is not None:
+            old = old.strip()
+        if current != old:
+            raise RefConflict("{0} is at {1}, expected {2}".format(ref, current, old))
+
+        lock.write(new)
+        lock.commit()
 
 
 def object_resolve(repo, name):
@@ -212,13 +322,8 @@ def tree_parse_one(raw, start=0):
     # and read the path
     path = raw[x + 1:y]
 
-    # Read the SHA and convert to an hex string
-    sha = hex(
-        int.from_bytes(
-            raw[y + 1:y + 21], "big"))[2:]  # hex() adds 0x in front,
-    if len(sha) == 39:
-        sha = "0" + sha
-    # we don't want that.
+    # Read the SHA and convert to an hex string, keeping leading zeros
+    sha = raw[y + 1:y + 21].hex()
     return y + 21, GitTreeLeaf(mode.decode("utf-8"), path.decode("utf-8"), sha)
 
 
@@ -245,6 +350,7 @@ def tree_serialize(obj):
     return ret
 
 
+@tracing.traced("tree_checkout")
 def tree_checkout(repo, tree, path):
     for item in tree.items:
         obj = object_read(repo, item.sha)
@@ -337,3 +443,19 @@ class GitPyCommit(GitPyObject):
 
     def serialize(self):
         return kvlm_serialize(self.kvlm)
+
+
+def object_links(fmt, data):
+    """Returns the SHAs that an object of type fmt, serialized as data, points to"""
+    if fmt == b'tree':
+        return [leaf.sha for leaf in tree_parse(data)]
+
+    links = []
+    if fmt in (b'commit', b'tag'):
+        kvlm = kvlm_parse(data)
+        for key in (b'tree', b'parent', b'object'):
+            values = kvlm.get(key, [])
+            if type(values) != list:
+                values = [values]
+            links.extend(v.decode("ascii") for v in values)
+    return links
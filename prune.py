@@ -0,0 +1,206 @@
+import os
+import re
+import time
+import tracing
+import zlib
+from gitpy import index_list
+from objects import TMP_OBJECT_PREFIX, object_iter, object_links, ref_list
+from util import repo_dir
+
+# Default grace period of gc --prune, like git
+DEFAULT_PRUNE = "2.weeks.ago"
+
+# Temporary object files are only removed after this many seconds whatever --prune says, as they may
+# belong to an object_write still in progress
+TMP_OBJECT_EXPIRE = 60 * 60
+
+AGE_UNITS = {
+    "second": 1,
+    "minute": 60,
+    "hour": 60 * 60,
+    "day": 24 * 60 * 60,
+    "week": 7 * 24 * 60 * 60,
+    "month": 30 * 24 * 60 * 60,
+    "year": 365 * 24 * 60 * 60,
+}
+
+
+def parse_age(text):
+    """Parses a --prune age ("now", "never", "3600", "2.weeks.ago"...) into seconds, None meaning never"""
+    text = text.strip().lower()
+    if text == "never":
+        return None
+    if text == "now":
+        return 0
+    if text.isdigit():
+        return int(text)
+
+    m = re.match(r"^(\d+)[. ]([a-z]+?)s?([. ]ago)?$", text)
+    if not m or m.group(2) not in AGE_UNITS:
+        raise Exception("Invalid prune age {0}!".format(text))
+
+    return int(m.group(1)) * AGE_UNITS[m.group(2)]
+
+
+class ObjectBitmap(object):
+    """The SHAs of the object store packed in a sorted bytearray (20 bytes each), with one mark bit per
+    object. A 256-entry fanout table on the first byte narrows lookups, as in git's pack indexes.
+    10M objects take about 200MB for the SHAs and 1.25MB for the bitmap."""
+
+    def __init__(self, shas):
+        self.shas = bytearray()
+        self.fanout = [0] * 257
+        for sha in shas:
+            try:
+                raw = bytes.fromhex(sha)
+            except ValueError:
+                # Not an object, e.g. a leftover temporary file
+                continue
+            if len(raw) != 20:
+                continue
+            self.shas += raw
+            self.fanout[raw[0] + 1] += 1
+
+        for i in range(256):
+            self.fanout[i + 1] += self.fanout[i]
+
+        self.count = len(self.shas) // 20
+        self.bits = bytearray((self.count + 7) // 8)
+
+    def sha(self, i):
+        return self.shas[i * 20:(i + 1) * 20].hex()
+
+    def index(self, sha):
+        """Returns the position of sha in the sorted list, or -1 if it isn't in the store"""
+        try:
+            raw = bytes.fromhex(sha)
+        except ValueError:
+            return -1
+        if len(raw) != 20:
+            return -1
+
+        lo = self.fanout[raw[0]]
+        hi = self.fanout[raw[0] + 1]
+        while lo < hi:
+            mid = (lo + hi) // 2
+            cur = self.shas[mid * 20:(mid + 1) * 20]
+            if cur < raw:
+                lo = mid + 1
+            elif cur > raw:
+                hi = mid
+            else:
+                return mid
+        return -1
+
+    def mark(self, i):
+        self.bits[i >> 3] |= 1 << (i & 7)
+
+    def marked(self, i):
+        return self.bits[i >> 3] & (1 << (i & 7))
+
+
+class CorruptObject(Exception):
+    pass
+
+
+def loose_object_links(objects_dir, sha):
+    """Returns the SHAs an object points to. Only the header of blobs is decompressed."""
+    with open(os.path.join(objects_dir, sha[0:2], sha[2:]), "rb") as f:
+        compressed = f.read()
+
+    try:
+        header = zlib.decompressobj().decompress(compressed, 32)
+        if header.startswith(b'blob '):
+            return ()
+
+        raw = zlib.decompress(compressed)
+        y = raw.find(b'\x00')
+        return object_links(raw[0:raw.find(b' ')], raw[y + 1:])
+    except Exception as e:
+        raise CorruptObject("Object {0} is corrupt ({1}), run `gitpy fsck` to find the damaged objects. "
+                            "Nothing was pruned.".format(sha, e))
+
+
+@tracing.traced("mark")
+def mark_reachable(repo, bitmap):
+    """Marks every object reachable from HEAD, the refs and the INDEX. Returns the number marked."""
+    objects_dir = repo_dir(repo, "objects")
+    stack = ref_list(repo) + index_list(repo)
+    marked = 0
+
+    while stack:
+        i = bitmap.index(stack.pop())
+        # Missing objects are left for fsck to report
+        if i < 0 or bitmap.marked(i):
+            continue
+        bitmap.mark(i)
+        marked += 1
+
+        stack.extend(loose_object_links(objects_dir, bitmap.sha(i)))
+
+    return marked
+
+
+def prune_tmp_objects(objects_dir, cutoff):
+    """Deletes the temporary files left in objects/ by object_writes that crashed before cutoff"""
+    for name in os.listdir(objects_dir):
+        if not name.startswith(TMP_OBJECT_PREFIX):
+            continue
+        path = os.path.join(objects_dir, name)
+        try:
+            if os.stat(path).st_mtime <= cutoff:
+                os.remove(path)
+        except FileNotFoundError:
+            # Renamed into place by its writer
+            continue
+
+
+@tracing.traced("prune")
+def prune(repo, expire=parse_age(DEFAULT_PRUNE), dry_run=False, out=None):
+    """Deletes the unreachable loose objects older than expire seconds (never if None), writing their
+    SHAs to out if given. Returns the number of objects pruned. Raises CorruptObject, before deleting
+    anything, if a reachable object can't be read."""
+    objects_dir = repo_dir(repo, "objects")
+    if objects_dir is None or expire is None:
+        return 0
+
+    # Take the cutoff before listing, so that objects written while gc runs are always recent enough
+    # to be kept. Objects written before it but not referenced yet (e.g. by an add still hashing files)
+    # are only protected by the grace period.
+    cutoff = time.time() - expire
+
+    bitmap = ObjectBitmap(object_iter(repo))
+    mark_reachable(repo, bitmap)
+
+    pruned = 0
+    prefixes = set()
+    for i in range(bitmap.count):
+        if bitmap.marked(i):
+            continue
+
+        sha = bitmap.sha(i)
+        path = os.path.join(objects_dir, sha[0:2], sha[2:])
+        try:
+            if os.stat(path).st_mtime > cutoff:
+                continue
+            if not dry_run:
+                os.remove(path)
+        except FileNotFoundError:
+            continue
+
+        pruned += 1
+        prefixes.add(sha[0:2])
+        if out:
+            out.write(sha + "\n")
+
+    if not dry_run:
+        prune_tmp_objects(objects_dir, min(cutoff, time.time() - TMP_OBJECT_EXPIRE))
+
+        for prefix in prefixes:
+            try:
+                os.rmdir(os.path.join(objects_dir, prefix))
+            except OSError:
+                # Directory still holds objects
+                pass
+
+    return pruned
@@ -0,0 +1,146 @@
+import functools
+import os
+import sys
+import time
+
+# Opt-in performance tracing. Enable it with the GITPY_TRACE=<file> environment variable
+# or the --trace <file> flag. Everything here is a no-op while `enabled` is False.
+
+enabled = False
+trace_path = None
+trace_format = "summary"
+
+counters = {}
+# Phase name -> [calls, total seconds, active depth]
+phases = {}
+# Chrome trace events, only collected for the "chrome" format
+events = []
+start_time = None
+
+
+def start(path, fmt=None):
+    """Enables tracing, the report is written to path ('-' for stderr) by stop()"""
+    global enabled, trace_path, trace_format, start_time
+
+    fmt = fmt or os.environ.get("GITPY_TRACE_FORMAT") or "summary"
+    if fmt not in ("summary", "chrome"):
+        raise Exception("Unknown trace format %s!" % fmt)
+
+    counters.clear()
+    phases.clear()
+    del events[:]
+    trace_path = path
+    trace_format = fmt
+    start_time = time.perf_counter()
+    enabled = True
+
+
+def stop():
+    """Disables tracing and writes the report"""
+    global enabled
+    import json
+
+    if not enabled:
+        return
+    enabled = False
+
+    if trace_format == "chrome":
+        # The counters are totals for the whole run: one counter event at the end, plus the raw values
+        # in otherData for tools that don't draw counter tracks
+        events.append({
+            "name": "counters",
+            "ph": "C",
+            "ts": (time.perf_counter() - start_time) * 1e6,
+            "pid": os.getpid(),
+            "args": dict(counters),
+        })
+        report = {"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"counters": dict(counters)}}
+    else:
+        report = summary()
+
+    if trace_path == "-":
+        json.dump(report, sys.stderr, indent=2)
+        sys.stderr.write("\n")
+    else:
+        with open(trace_path, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+def summary():
+    """Returns the counters and per-phase timings collected so far"""
+    return {
+        "wall_seconds": time.perf_counter() - start_time,
+        "phases": {name: {"calls": p[0], "seconds": p[1]} for name, p in phases.items()},
+        "counters": dict(counters),
+    }
+
+
+def count(name, n=1):
+    """Adds n to a counter. Callers should check `enabled` first to keep the disabled path cheap."""
+    counters[name] = counters.get(name, 0) + n
+
+
+class Span(object):
+    """Times a phase. Recursive spans of the same phase are only counted once in the summary."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        phase = phases.get(self.name)
+        if phase is None:
+            phase = phases[self.name] = [0, 0.0, 0]
+        phase[2] += 1
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        phase = phases[self.name]
+        phase[0] += 1
+        phase[2] -= 1
+        if phase[2] == 0:
+            phase[1] += end - self.start
+
+        if trace_format == "chrome":
+            import threading
+            events.append({
+                "name": self.name,
+                "ph": "X",
+                "ts": (self.start - start_time) * 1e6,
+                "dur": (end - self.start) * 1e6,
+                "pid": os.getpid(),
+                "tid": threading.get_ident(),
+            })
+        return False
+
+
+class _NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_null_span = _NullSpan()
+
+
+def span(name):
+    """Context manager timing the phase name while tracing is enabled"""
+    if not enabled:
+        return _null_span
+    return Span(name)
+
+
+def traced(name):
+    """Decorator timing every call to the function as the phase name"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return fn(*args, **kwargs)
+            with Span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -1,53 +1,133 @@
-import gitpy
 import os
+import random
+import time
+import tracing
 
 
 def repo_path(repo, *path):
-    return gitpy.os.path.join(repo.gitdir, *path)
+    return os.path.join(repo.gitdir, *path)
 
 
 def repo_file(repo, *path, mkdir=False):
-    if gitpy.repo_dir(repo, *path[:-1], mkdir=mkdir):
+    if repo_dir(repo, *path[:-1], mkdir=mkdir):
         return repo_path(repo, *path)
 
 
 def repo_dir(repo, *path, mkdir=False):
     path = repo_path(repo, *path)
-    if gitpy.os.path.exists(path):
-        if gitpy.os.path.isdir(path):
+    if os.path.exists(path):
+        if os.path.isdir(path):
             return path
         else:
             raise Exception("Not a directory %s" % path)
 
     if mkdir:
-        gitpy.os.makedirs(path)
+        os.makedirs(path)
         return path
     else:
         return None
 
 
+# How long to keep retrying to take a lock held by another process, in seconds
+LOCK_TIMEOUT = 10.0
+# First and maximum delay between retries, the delay doubles after each attempt
+LOCK_RETRY_DELAY = 0.001
+LOCK_RETRY_MAX_DELAY = 0.1
+
+
+class LockError(Exception):
+    pass
+
+
+class LockFile(object):
+    """Exclusive lock on path through a `<path>.lock` file, like git does.
+
+    The new content is written to the lock file, and commit() atomically renames it over path, so
+    readers always see either the old or the new content. Leaving the with block without committing
+    discards the changes and releases the lock."""
+
+    def __init__(self, path, mode="w", timeout=LOCK_TIMEOUT):
+        self.path = path
+        self.lock_path = path + ".lock"
+        self.file = None
+
+        delay = LOCK_RETRY_DELAY
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                fd = os.open(self.lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+                break
+            except FileExistsError:
+                if time.monotonic() >= deadline:
+                    raise LockError("Unable to lock {0}: another gitpy process seems to be running. "
+                                    "If not, remove {1}.".format(path, self.lock_path))
+                if tracing.enabled:
+                    tracing.count("lock_retries")
+                # Jitter so that waiting processes don't retry in lockstep
+                time.sleep(delay * random.uniform(0.5, 1.5))
+                delay = min(delay * 2, LOCK_RETRY_MAX_DELAY)
+
+        self.file = os.fdopen(fd, mode)
+
+    def write(self, data):
+        self.file.write(data)
+
+    def commit(self):
+        """Replaces path with the written content and releases the lock"""
+        self.file.close()
+        os.replace(self.lock_path, self.path)
+        self.file = None
+
+    def rollback(self):
+        """Releases the lock, leaving path untouched"""
+        if self.file is not None:
+            self.file.close()
+            os.remove(self.lock_path)
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.rollback()
+        return False
+
+
+# Repositories already opened by repo_find, keyed by worktree path, so that
+# repeated lookups in the same process don't parse the config again.
+_repo_cache = {}
+
+
 def repo_find(path=".", required=True):
-    path = gitpy.os.path.realpath(path)
+    """Finds the repository containing path by walking up towards the filesystem root"""
+    from gitpy import GitPyRepository
 
-    if gitpy.os.path.isdir(gitpy.os.path.join(path, ".gitpy")):
-        return gitpy.GitPyRepository(path)
+    path = os.path.realpath(path)
 
-    # If we haven't returned, recurse in parent, if w
-    parent = gitpy.os.path.realpath(gitpy.os.path.join(path, ".."))
+    while not os.path.isdir(os.path.join(path, ".gitpy")):
+        parent = os.path.dirname(path)
 
-    if parent == path:
-        # Bottom case
-        # os.path.join("/", "..") == "/":
-        # If parent==path, then path is root.
-        if required:
-            raise Exception("No git directory.")
-        else:
-            return None
+        if parent == path:
+            # os.path.dirname("/") == "/": we reached the root
+            if required:
+                raise Exception("No git directory.")
+            else:
+                return None
+
+        path = parent
+
+    repo = _repo_cache.get(path)
+    if repo is None:
+        repo = _repo_cache[path] = GitPyRepository(path)
+        if tracing.enabled:
+            tracing.count("repo_cache_misses")
+    elif tracing.enabled:
+        tracing.count("repo_cache_hits")
 
-    # Recursive case
-    return gitpy.repo_find(parent, required)
+    return repo
 
 
+@tracing.traced("walk")
 def get_files(path, repo):
     filelist = []
     for root, dirs, files in os.walk(path):